@@ -1,12 +1,17 @@
 import streamlit as st
 from datetime import date
 from pathlib import Path
+import os
+import tempfile
 from openpyxl import load_workbook
+from python_calamine import CalamineWorkbook
+from openpyxl.utils import column_index_from_string
 import pandas as pd
 
 st.set_page_config(page_title="Rota Leave Entry", layout="centered")
 
 TEMPLATE_DEFAULT = "Rota_Publish_Template_ORtools.xlsx"
+MAX_BLANK_RUN = 1000  # consecutive blank Leave rows treated as the end of the data
 
 st.title("Rota Leave Entry")
 st.write("Enter leave requests and write them into the **Leave** sheet of the rota template workbook.")
@@ -19,39 +24,67 @@ if uploaded is None:
     st.info(f"Upload your workbook (default filename: {TEMPLATE_DEFAULT}).")
     st.stop()
 
-# Save uploaded workbook to a local temp file
-tmp_path = Path("uploaded_rota.xlsx")
-tmp_path.write_bytes(uploaded.getbuffer())
+# Save uploaded workbook to a local temp file (only when a new file is uploaded,
+# so rows added below survive reruns). The path is per session: a shared file would
+# let one user's upload replace another's workbook.
+if "_upload_tmp_path" not in st.session_state:
+    fd, tmp_name = tempfile.mkstemp(prefix="uploaded_rota_", suffix=".xlsx")
+    os.close(fd)
+    st.session_state["_upload_tmp_path"] = tmp_name
+tmp_path = Path(st.session_state["_upload_tmp_path"])
+if st.session_state.get("_uploaded_file_id") != uploaded.file_id:
+    tmp_path.write_bytes(uploaded.getbuffer())
+    st.session_state["_uploaded_file_id"] = uploaded.file_id
 
-wb = load_workbook(tmp_path)
-if "Leave" not in wb.sheetnames or "Consultants" not in wb.sheetnames:
+def _read_sheets(path, *names: str):
+    # python-calamine (Rust) parses each sheet straight into lists of row values,
+    # much faster than openpyxl's XML reader. Empty cells come back as "".
+    wb = CalamineWorkbook.from_path(str(path))
+    if not set(names) <= set(wb.sheet_names):
+        return None
+    return {n: wb.get_sheet_by_name(n).to_python(skip_empty_area=False) for n in names}
+
+def _data_rows(rows: list, ncols: int, min_row: int = 2):
+    # Rows start at A1 but only span the sheet's used width; pad/trim each to ncols cells.
+    pad = [""] * max(0, ncols - len(rows[0])) if rows else []
+    for row in rows[min_row - 1:]:
+        yield row[:ncols] + pad
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_upload(path_str: str, mtime: float, size: int):
+    # mtime/size are part of the cache key so the cache invalidates when the file changes.
+    sheets = _read_sheets(path_str, "Consultants", "Leave")
+    if sheets is None:
+        return None
+
+    # --- Read consultants (active only) ---
+    names = set()
+    for nm, _, _, _, _, active in _data_rows(sheets["Consultants"], 6):
+        if nm and bool(active):
+            names.add(str(nm))
+
+    # --- Read existing leave into a table ---
+    existing = []
+    # calamine already trims the sheet to its used range, so every blank row is just a gap.
+    for nm, sd, ed, lt, appr in _data_rows(sheets["Leave"], 5):
+        if nm == "":
+            continue
+        existing.append({
+            "Name": str(nm),
+            "StartDate": sd or None,
+            "EndDate": ed or None,
+            "LeaveType": lt or None,
+            "Approved": bool(appr),
+        })
+    return {"names": tuple(sorted(names)), "existing": existing}
+
+tmp_stat = tmp_path.stat()
+data = _load_upload(str(tmp_path), tmp_stat.st_mtime, tmp_stat.st_size)
+if data is None:
     st.error("Workbook must contain sheets named 'Leave' and 'Consultants'.")
     st.stop()
-
-# --- Read consultants (active only) ---
-cws = wb["Consultants"]
-names = []
-for r in range(2, 2000):
-    nm = cws[f"A{r}"].value
-    active = cws[f"F{r}"].value
-    if nm and bool(active):
-        names.append(str(nm))
-names = sorted(names)
-
-# --- Read existing leave into a table ---
-lws = wb["Leave"]
-existing = []
-for r in range(2, 5000):
-    nm = lws[f"A{r}"].value
-    if nm is None or nm == "":
-        continue
-    existing.append({
-        "Name": str(nm),
-        "StartDate": lws[f"B{r}"].value,
-        "EndDate": lws[f"C{r}"].value,
-        "LeaveType": lws[f"D{r}"].value,
-        "Approved": bool(lws[f"E{r}"].value) if lws[f"E{r}"].value is not None else False,
-    })
+names = data["names"]
+existing = data["existing"]
 
 st.subheader("2) Add leave request")
 with st.form("leave_form"):
@@ -65,16 +98,32 @@ with st.form("leave_form"):
     approved = st.checkbox("Approved", value=True)
     submitted = st.form_submit_button("Add to workbook")
 
-def find_next_empty_row(ws, start_row=2, col="A", max_row=20000):
-    for rr in range(start_row, max_row + 1):
-        if ws[f"{col}{rr}"].value in (None, ""):
-            return rr
-    return max_row + 1
+def find_next_empty_row(ws, start_row=2, col="A"):
+    # Start from the sheet's used range and only step back over trailing blanks.
+    rr = ws.max_row
+    floor = max(start_row - 1, rr - MAX_BLANK_RUN)
+    while rr > floor and ws[f"{col}{rr}"].value in (None, ""):
+        rr -= 1
+    if rr > floor or rr == start_row - 1:
+        return rr + 1
+
+    # max_row is inflated (e.g. formatting applied down to row 1048576): scan
+    # forward instead and give up after MAX_BLANK_RUN consecutive blank rows.
+    ci = column_index_from_string(col)
+    last = start_row - 1
+    for rr, (v,) in enumerate(ws.iter_rows(min_row=start_row, min_col=ci, max_col=ci, values_only=True), start=start_row):
+        if v not in (None, ""):
+            last = rr
+        elif rr - last > MAX_BLANK_RUN:
+            break
+    return last + 1
 
 if submitted:
     if end_date < start_date:
         st.error("Date to cannot be earlier than Date from.")
     else:
+        wb = load_workbook(tmp_path)
+        lws = wb["Leave"]
         rr = find_next_empty_row(lws, start_row=2, col="A")
         lws[f"A{rr}"].value = name
         lws[f"B{rr}"].value = start_date
@@ -92,11 +141,16 @@ if df.empty:
 else:
     st.dataframe(df, width=True, hide_index=True)
 
+@st.cache_data(show_spinner=False, max_entries=2)
+def _file_bytes(path: str, mtime: float, size: int) -> bytes:
+    # mtime/size are part of the cache key (as for _load_upload), so the file is only re-read after it has been written.
+    return Path(path).read_bytes()
+
 st.subheader("4) Download updated workbook")
-with open(tmp_path, "rb") as f:
-    st.download_button(
-        label="Download updated rota workbook",
-        data=f,
-        file_name="Rota_Publish_Template_ORtools_UPDATED.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+dl_stat = tmp_path.stat()
+st.download_button(
+    label="Download updated rota workbook",
+    data=_file_bytes(str(tmp_path), dl_stat.st_mtime, dl_stat.st_size),
+    file_name="Rota_Publish_Template_ORtools_UPDATED.xlsx",
+    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
@@ -1,10 +1,28 @@
 import streamlit as st
+import ctypes.util
 from datetime import date, datetime
 from pathlib import Path
-from typing import Optional, List, Dict
-
+import os
+import shutil
+import socket
+import sys
+import time
+from typing import Optional, Dict, Tuple
+
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
+from python_calamine import CalamineWorkbook
+
+try:
+    import fcntl  # POSIX only
+except ImportError:
+    fcntl = None
+
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)  # Linux _IOW(0x94, 9, int)
+MAX_BLANK_RUN = 1000  # consecutive blank Leave rows treated as the end of the data
+LEAVE_COLS = ["RowID", "Name", "StartDate", "EndDate", "LeaveType", "Approved"]
+LOCK_STALE_SECONDS = 300  # a lock file older than this is left over from a crashed session
 
 st.set_page_config(page_title="Rota Leave Admin", layout="wide")
 
@@ -40,89 +58,229 @@ with colB:
 
 # Optional file locking (best-effort)
 enable_lock = st.checkbox(
-    "Use a simple lock file to reduce concurrent edits",
+    "Lock the workbook while writing to reduce concurrent edits",
     value=True,
-    help="Creates a .lock file next to the workbook while writing. Not a perfect distributed lock."
+    help="Takes an advisory lock on the workbook (a .lock file next to it on Windows) while writing. Not a perfect distributed lock."
 )
 
 def lock_path_for(path: Path) -> Path:
     return path.with_suffix(path.suffix + ".lock")
 
-def acquire_lock(path: Path) -> bool:
+def acquire_lock(path: Path):
+    """Return a lock handle, or None if another session holds the lock."""
+    if fcntl is not None:
+        # Advisory flock on the workbook itself: no extra file to create/delete on the
+        # shared drive, and the lock is dropped automatically if the process dies.
+        fd = os.open(path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except OSError:
+            os.close(fd)  # filesystem without flock support: use the lock file below
     lp = lock_path_for(path)
+    for attempt in range(2):
+        try:
+            # O_EXCL: creation fails if another session already holds the lock file
+            fd = os.open(lp, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            age = lock_age(lp)
+            if attempt or age is None or age < LOCK_STALE_SECONDS:
+                return None
+            # Stale (its session crashed between acquire and release): move it aside and retry once.
+            # The rename is atomic, so only one session gets to break a given stale lock.
+            stale = lp.with_name(f"{lp.name}.stale.{os.getpid()}.{time.time_ns()}")
+            try:
+                os.replace(lp, stale)
+                stale.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+            continue
+        os.write(fd, f"pid={os.getpid()} host={socket.gethostname()} at={datetime.now().isoformat(timespec='seconds')}\n".encode())
+        os.close(fd)
+        return lp
+    return None
+
+def lock_age(lp: Path) -> Optional[float]:
     try:
-        # exclusive create
-        lp.write_text(f"locked at {datetime.now().isoformat()}\n", encoding="utf-8")
-        return True
-    except Exception:
-        return False
+        return time.time() - lp.stat().st_mtime
+    except FileNotFoundError:
+        return None
 
-def release_lock(path: Path) -> None:
+def lock_busy_message(path: Path) -> str:
+    msg = "Workbook is currently locked by another session."
     lp = lock_path_for(path)
+    age = lock_age(lp)
+    if age is not None:
+        try:
+            holder = lp.read_text().strip()
+        except OSError:
+            holder = ""
+        msg += f" Lock file `{lp.name}` is {int(age)} s old" + (f" ({holder})" if holder else "") + "."
+        msg += f" It is cleared automatically once older than {LOCK_STALE_SECONDS // 60} min, or delete it by hand if that session is gone."
+    return msg + " Try again shortly."
+
+def release_lock(lock) -> None:
+    if lock is None:
+        return
     try:
-        if lp.exists():
-            lp.unlink()
-    except Exception:
+        if isinstance(lock, Path):
+            lock.unlink(missing_ok=True)
+        else:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            os.close(lock)
+    except OSError:
         pass
 
+def _clone_file(src: Path, dst: Path) -> None:
+    # Prefer a copy-on-write clone (APFS clonefile / Linux FICLONE): no data is copied at all.
+    # Otherwise shutil.copyfile, which stays in the kernel via sendfile/fcopyfile.
+    if sys.platform == "darwin":
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+            return
+    elif fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
 def backup_file(path: Path) -> Optional[Path]:
     try:
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         bkp = path.with_name(f"{path.stem}_backup_{ts}{path.suffix}")
-        bkp.write_bytes(path.read_bytes())
+        _clone_file(path, bkp)
         return bkp
     except Exception:
         return None
 
-def excel_date(v) -> Optional[date]:
-    if v is None or v == "":
+def _read_sheets(path, *names: str) -> Optional[Dict[str, list]]:
+    # python-calamine (Rust) parses each sheet straight into lists of row values,
+    # much faster than openpyxl's XML reader. Empty cells come back as "".
+    wb = CalamineWorkbook.from_path(str(path))
+    if not set(names) <= set(wb.sheet_names):
         return None
-    if isinstance(v, datetime):
-        return v.date()
-    if isinstance(v, date):
-        return v
-    return pd.to_datetime(v).date()
+    return {n: wb.get_sheet_by_name(n).to_python(skip_empty_area=False) for n in names}
+
+def _data_rows(rows: list, ncols: int, min_row: int = 2):
+    # Rows start at A1 but only span the sheet's used width; pad/trim each to ncols cells.
+    pad = [""] * max(0, ncols - len(rows[0])) if rows else []
+    for row in rows[min_row - 1:]:
+        yield row[:ncols] + pad
 
 def read_master(path: Path) -> Dict:
-    wb = load_workbook(path)
-    if "Leave" not in wb.sheetnames or "Consultants" not in wb.sheetnames:
+    sheets = _read_sheets(path, "Consultants", "Leave")
+    if sheets is None:
         raise ValueError("Workbook must contain 'Leave' and 'Consultants' sheets.")
 
-    cws = wb["Consultants"]
-    names: List[str] = []
-    for r in range(2, 2000):
-        nm = cws[f"A{r}"].value
-        active = cws[f"F{r}"].value
+    active_names = set()
+    for nm, _, _, _, _, active in _data_rows(sheets["Consultants"], 6):
         if nm and bool(active):
-            names.append(str(nm))
-    names = sorted(set(names))
+            active_names.add(str(nm))
+    # Sorted once here and cached as an immutable tuple shared by every rerun/session.
+    names: Tuple[str, ...] = tuple(sorted(active_names))
 
-    lws = wb["Leave"]
     rows = []
-    for r in range(2, 5000):
-        nm = lws[f"A{r}"].value
-        if nm is None or nm == "":
+    for r, (nm, sd, ed, lt, appr) in enumerate(_data_rows(sheets["Leave"], 5), start=2):
+        # Deleted rows are cleared in place, so skip blanks; calamine already trims the
+        # sheet to its used range, so there is no trailing run of empty rows to cut short.
+        if nm == "":
             continue
-        rows.append({
-            "RowID": r,  # sheet row number, used for edit/delete
-            "Name": str(nm),
-            "StartDate": excel_date(lws[f"B{r}"].value),
-            "EndDate": excel_date(lws[f"C{r}"].value),
-            "LeaveType": str(lws[f"D{r}"].value or ""),
-            "Approved": bool(lws[f"E{r}"].value) if lws[f"E{r}"].value is not None else False,
-        })
-
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df = df.sort_values(["Name", "StartDate", "EndDate"], na_position="last").reset_index(drop=True)
-
-    return {"wb": wb, "names": names, "df": df}
+        # RowID is the sheet row number, used for edit/delete
+        rows.append((r, str(nm), sd, ed, str(lt), bool(appr)))
 
-def next_empty_row(lws, start_row=2, max_row=20000) -> int:
-    for r in range(start_row, max_row + 1):
-        if lws[f"A{r}"].value in (None, ""):
-            return r
-    return max_row + 1
+    df = pd.DataFrame.from_records(rows, columns=LEAVE_COLS)
+    if not df.empty:
+        # Coerce whole date columns at once; unparseable cells become None.
+        for col in ("StartDate", "EndDate"):
+            parsed = pd.to_datetime(df[col], errors="coerce", format="mixed")
+            df[col] = parsed.dt.date.where(parsed.notna(), None)
+
+    return {"names": names, "df": _index_leave_df(df)}
+
+def _index_leave_df(df: pd.DataFrame) -> pd.DataFrame:
+    # Expects plain str Name/LeaveType columns in sheet row order.
+    if df.empty:
+        return df
+    df = df.sort_values(["Name", "StartDate", "EndDate"], na_position="last").reset_index(drop=True)
+    # Lowercased columns are built once here so filtering never re-lowercases per rerun.
+    df["_name_lc"] = df["Name"].str.lower().astype("category")
+    df["_type_lc"] = df["LeaveType"].str.lower().astype("category")
+    df["Name"] = df["Name"].astype("category")
+    df["LeaveType"] = df["LeaveType"].astype("category")
+    return df
+
+def _sheet_rows(df: pd.DataFrame) -> pd.DataFrame:
+    # Plain copy of the sheet columns in row order, ready to patch and re-index.
+    return df[LEAVE_COLS].astype({"Name": str, "LeaveType": str}).sort_values("RowID", ignore_index=True)
+
+def master_stat_key(path: Path) -> Tuple[str, float, int]:
+    stat = path.stat()
+    return (str(path), stat.st_mtime, stat.st_size)
+
+def remember_written(path: Path, frame_key: tuple, loaded_key: tuple, names: Tuple[str, ...], rows: pd.DataFrame) -> None:
+    # We already know what the sheet holds after our own write, so keep the patched
+    # frame under the workbook's new mtime/size and let the rerun skip re-reading it.
+    # rows was patched from the frame read at frame_key; if another session saved before we
+    # loaded the workbook under the lock (loaded_key differs), it misses their rows, so skip it.
+    if loaded_key != frame_key:
+        return
+    st.session_state["_master_written"] = (master_stat_key(path), {"names": names, "df": _index_leave_df(rows)})
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_master(path_str: str, mtime: float, size: int) -> Dict:
+    # mtime/size are part of the cache key so the cache invalidates when the file changes.
+    return read_master(Path(path_str))
+
+def _category_mask(col: pd.Series, value: str) -> np.ndarray:
+    # Compare the categorical's integer codes rather than the strings themselves.
+    code = col.cat.categories.get_indexer([value])[0]
+    if code < 0:
+        return np.zeros(len(col), dtype=bool)
+    return col.cat.codes.to_numpy() == code
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _filter_positions(df_key: tuple, _df: pd.DataFrame, name: str, type_: str, approved: str, search: str) -> np.ndarray:
+    # _df is not hashed by Streamlit; df_key identifies which cached frame it is.
+    mask = np.ones(len(_df), dtype=bool)
+    if name != "(All)":
+        mask &= _category_mask(_df["Name"], name)
+    if type_ != "(All)":
+        mask &= _category_mask(_df["_type_lc"], type_.lower())
+    if approved == "Approved only":
+        mask &= _df["Approved"].to_numpy(dtype=bool)
+    elif approved == "Not approved":
+        mask &= ~_df["Approved"].to_numpy(dtype=bool)
+    if search:
+        mask &= (
+            _df["_name_lc"].str.contains(search, regex=False, na=False)
+            | _df["_type_lc"].str.contains(search, regex=False, na=False)
+        ).to_numpy(dtype=bool)
+    return np.flatnonzero(mask)
+
+def next_empty_row(lws, start_row=2) -> int:
+    # Start from the sheet's used range and only step back over trailing blanks.
+    r = lws.max_row
+    floor = max(start_row - 1, r - MAX_BLANK_RUN)
+    while r > floor and lws.cell(row=r, column=1).value in (None, ""):
+        r -= 1
+    if r > floor or r == start_row - 1:
+        return r + 1
+
+    # max_row is inflated (e.g. formatting applied down to row 1048576): scan
+    # forward instead and give up after MAX_BLANK_RUN consecutive blank rows.
+    last = start_row - 1
+    for r, (v,) in enumerate(lws.iter_rows(min_row=start_row, max_col=1, values_only=True), start=start_row):
+        if v not in (None, ""):
+            last = r
+        elif r - last > MAX_BLANK_RUN:
+            break
+    return last + 1
 
 def validate_dates(s: date, e: date) -> Optional[str]:
     if e < s:
@@ -149,7 +307,12 @@ if master_path.suffix.lower() != ".xlsx":
 
 # Load master data
 try:
-    data = read_master(master_path)
+    master_key = master_stat_key(master_path)
+    written = st.session_state.get("_master_written")
+    if written is not None and written[0] == master_key:
+        data = written[1]  # this session's own last write; the file is unchanged since
+    else:
+        data = _load_master(*master_key)
 except Exception as e:
     st.exception(e)
     st.stop()
@@ -161,6 +324,13 @@ df = data["df"]
 # Add leave
 # -----------------------------
 st.subheader("2) Add leave request")
+
+# Adds are queued per session and written in a single save, so N adds cost one
+# workbook load/backup/save instead of N.
+if "pending_rows" not in st.session_state:
+    st.session_state["pending_rows"] = []
+pending_rows = st.session_state["pending_rows"]
+
 with st.form("add_form"):
     c1, c2, c3 = st.columns([2, 1, 1])
     with c1:
@@ -171,20 +341,40 @@ with st.form("add_form"):
     with c3:
         add_end = st.date_input("Date to", value=date.today(), key="add_end")
     add_approved = st.checkbox("Approved", value=True)
-    add_submit = st.form_submit_button("Add to master workbook")
+    add_submit = st.form_submit_button("Add to pending rows")
 
 if add_submit:
     err = validate_dates(add_start, add_end)
     if err:
         st.error(err)
     else:
+        pending_rows.append((add_name, add_start, add_end, normalize_leave_type(add_type), bool(add_approved)))
+
+if pending_rows:
+    st.caption(f"{len(pending_rows)} row(s) pending. They are written to the master workbook together.")
+    st.dataframe(
+        pd.DataFrame(pending_rows, columns=["Name", "StartDate", "EndDate", "LeaveType", "Approved"]),
+        use_container_width=True,
+        hide_index=True,
+    )
+    pc1, pc2 = st.columns([1, 1])
+    with pc1:
+        write_pending = st.button("Write pending rows to master workbook")
+    with pc2:
+        discard_pending = st.button("Discard pending rows")
+
+    if discard_pending:
+        pending_rows.clear()
+        st.rerun()
+
+    if write_pending:
         # Write
-        locked = False
+        lock = None
         try:
             if enable_lock:
-                locked = acquire_lock(master_path)
-                if not locked:
-                    st.error("Workbook is currently locked by another session. Try again shortly.")
+                lock = acquire_lock(master_path)
+                if lock is None:
+                    st.error(lock_busy_message(master_path))
                     st.stop()
 
             if make_backup:
@@ -195,21 +385,26 @@ if add_submit:
                     st.caption(f"Backup created: {bkp.name}")
 
             wb = load_workbook(master_path)
+            loaded_key = master_stat_key(master_path)  # stat after reading, so a save during the read shows up
             lws = wb["Leave"]
             r = next_empty_row(lws)
 
-            lws[f"A{r}"].value = add_name
-            lws[f"B{r}"].value = add_start
-            lws[f"C{r}"].value = add_end
-            lws[f"D{r}"].value = normalize_leave_type(add_type)
-            lws[f"E{r}"].value = bool(add_approved)
+            for offset, pending_row in enumerate(pending_rows):
+                for col, value in enumerate(pending_row, start=1):
+                    lws.cell(row=r + offset, column=col, value=value)
 
             wb.save(master_path)
-            st.success(f"Added leave: {add_name} {add_start} → {add_end} ({add_type}).")
+            added = pd.DataFrame.from_records(
+                [(r + offset, *pending_row) for offset, pending_row in enumerate(pending_rows)], columns=LEAVE_COLS
+            )
+            remember_written(master_path, master_key, loaded_key, names, pd.concat([_sheet_rows(df), added], ignore_index=True) if not df.empty else added)
+            n_added = len(pending_rows)
+            pending_rows.clear()
+            st.success(f"Added {n_added} leave row(s).")
             st.rerun()
         finally:
-            if enable_lock:
-                release_lock(master_path)
+            # Only releases a lock this session actually acquired
+            release_lock(lock)
 
 # -----------------------------
 # View / filter
@@ -218,7 +413,7 @@ st.subheader("3) View and filter leave entries")
 
 fc1, fc2, fc3, fc4 = st.columns([2, 1, 1, 1])
 with fc1:
-    filt_name = st.selectbox("Filter by consultant (optional)", options=["(All)"] + names)
+    filt_name = st.selectbox("Filter by consultant (optional)", options=["(All)", *names])
 with fc2:
     filt_type = st.selectbox("Filter by type", options=["(All)", "Annual", "Study", "NOC"])
 with fc3:
@@ -226,24 +421,11 @@ with fc3:
 with fc4:
     search = st.text_input("Search (contains)", value="")
 
-view = df.copy()
-if not view.empty:
-    if filt_name != "(All)":
-        view = view[view["Name"] == filt_name]
-    if filt_type != "(All)":
-        view = view[view["LeaveType"].str.lower() == filt_type.lower()]
-    if filt_approved == "Approved only":
-        view = view[view["Approved"] == True]
-    elif filt_approved == "Not approved":
-        view = view[view["Approved"] == False]
-    if search.strip():
-        s = search.strip().lower()
-        view = view[
-            view["Name"].str.lower().str.contains(s)
-            | view["LeaveType"].str.lower().str.contains(s)
-        ]
-
-st.dataframe(view, use_container_width=True, hide_index=True)
+view = df
+if not df.empty:
+    view = df.iloc[_filter_positions(master_key, df, filt_name, filt_type, filt_approved, search.strip().lower())]
+
+st.dataframe(view.drop(columns=[c for c in view.columns if c.startswith("_")]), use_container_width=True, hide_index=True)
 
 # -----------------------------
 # Edit / delete
@@ -264,8 +446,9 @@ with st.form("edit_form"):
     ec1, ec2, ec3, ec4 = st.columns([2, 1, 1, 1])
     with ec1:
         edit_name = st.selectbox("Consultant", options=names, index=names.index(row["Name"]) if row["Name"] in names else 0)
+        nt = normalize_leave_type(row.get("LeaveType", "Annual"))
         edit_type = st.selectbox("Leave type", options=["Annual", "Study", "NOC"],
-                                 index=["Annual","Study","NOC"].index(normalize_leave_type(row.get("LeaveType","Annual"))) if normalize_leave_type(row.get("LeaveType","Annual")) in ["Annual","Study","NOC"] else 0)
+                                 index=["Annual","Study","NOC"].index(nt) if nt in ["Annual","Study","NOC"] else 0)
     with ec2:
         edit_start = st.date_input("Date from", value=row["StartDate"] or date.today(), key="edit_start")
     with ec3:
@@ -284,11 +467,12 @@ if save_btn or delete_btn:
     if err:
         st.error(err)
     else:
+        lock = None
         try:
             if enable_lock:
-                locked = acquire_lock(master_path)
-                if not locked:
-                    st.error("Workbook is currently locked by another session. Try again shortly.")
+                lock = acquire_lock(master_path)
+                if lock is None:
+                    st.error(lock_busy_message(master_path))
                     st.stop()
 
             if make_backup:
@@ -299,6 +483,7 @@ if save_btn or delete_btn:
                     st.caption(f"Backup created: {bkp.name}")
 
             wb = load_workbook(master_path)
+            loaded_key = master_stat_key(master_path)  # stat after reading, so a save during the read shows up
             lws = wb["Leave"]
             r = int(selected_row)
 
@@ -307,6 +492,8 @@ if save_btn or delete_btn:
                 for col in ("A","B","C","D","E"):
                     lws[f"{col}{r}"].value = None
                 wb.save(master_path)
+                rows = _sheet_rows(df)
+                remember_written(master_path, master_key, loaded_key, names, rows[rows["RowID"] != r])
                 st.success(f"Deleted leave row RowID={r}.")
                 st.rerun()
             else:
@@ -316,9 +503,14 @@ if save_btn or delete_btn:
                 lws[f"D{r}"].value = normalize_leave_type(edit_type)
                 lws[f"E{r}"].value = bool(edit_approved)
                 wb.save(master_path)
+                rows = _sheet_rows(df)
+                rows.loc[rows["RowID"] == r, LEAVE_COLS[1:]] = [
+                    edit_name, edit_start, edit_end, normalize_leave_type(edit_type), bool(edit_approved)
+                ]
+                remember_written(master_path, master_key, loaded_key, names, rows)
                 st.success(f"Updated RowID={r}.")
                 st.rerun()
 
         finally:
-            if enable_lock:
-                release_lock(master_path)
+            # Only releases a lock this session actually acquired
+            release_lock(lock)
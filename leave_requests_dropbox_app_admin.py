@@ -1,10 +1,25 @@
 import streamlit as st
+import ctypes.util
 from datetime import date, datetime
 from pathlib import Path
-import json
+import os
+import shutil
+import sys
+import tempfile
+import time
 import uuid
+import numpy as np
+import orjson
 import pandas as pd
 from openpyxl import load_workbook
+from python_calamine import CalamineWorkbook
+
+try:
+    import fcntl  # POSIX only
+except ImportError:
+    fcntl = None
+
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)  # Linux _IOW(0x94, 9, int)
 
 st.set_page_config(page_title="Rota Leave Requests", layout="wide")
 
@@ -55,86 +70,309 @@ if not requests_dir_str:
 requests_dir.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_TYPES = ["Annual", "Study", "NOC"]
+INDEX_FILE = "_index.json"  # consolidated snapshot of every request file
+MAX_BLANK_RUN = 1000  # consecutive blank Leave rows treated as the end of the data
 
 def now_iso() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
+LEAVE_TYPE_MAP = {"annual": "Annual", "study": "Study", "noc": "NOC"}
+
 def normalize_leave_type(t: str) -> str:
-    t = (t or "").strip()
-    mapping = {"annual": "Annual", "study": "Study", "noc": "NOC"}
-    return mapping.get(t.lower(), t)
+    t = str(t or "").strip()
+    return LEAVE_TYPE_MAP.get(t.lower(), t)
+
+def parse_date(v) -> date | None:
+    # Fast path for the plain ISO dates this app writes; older files may hold full timestamps
+    # or other formats, which still go through pandas as before.
+    if not v:
+        return None
+    try:
+        return date.fromisoformat(str(v)[:10])
+    except ValueError:
+        return pd.to_datetime(v).date()
+
+def new_request_id() -> str:
+    # UUIDv7 (RFC 9562): a 48-bit millisecond timestamp prefix, so request files sort by creation time.
+    if hasattr(uuid, "uuid7"):  # Python 3.14+
+        return str(uuid.uuid7())
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (ms & ((1 << 48) - 1)) << 80
+        | 0x7 << 76                        # version
+        | ((rand >> 62) & 0xFFF) << 64     # rand_a
+        | 0b10 << 62                       # variant
+        | rand & ((1 << 62) - 1)           # rand_b
+    )
+    return str(uuid.UUID(int=value))
 
 def request_file_path(req_id: str) -> Path:
     return requests_dir / f"{req_id}.json"
 
-def load_requests() -> pd.DataFrame:
-    rows = []
-    for p in sorted(requests_dir.glob("*.json")):
+def _read_index(d: Path) -> dict | None:
+    try:
+        index = orjson.loads((d / INDEX_FILE).read_bytes())
+    except Exception:
+        return None
+    # {"files": {request_id: [st_mtime_ns, st_size]}, "requests": {request_id: request}}
+    if not isinstance(index, dict) or not isinstance(index.get("files"), dict) or not isinstance(index.get("requests"), dict):
+        return None
+    return index
+
+def _file_sig(p: Path) -> list[int]:
+    st_ = p.stat()
+    return [st_.st_mtime_ns, st_.st_size]
+
+def _write_index(d: Path, index: dict) -> None:
+    # Unique temp name per writer: sessions are threads in one process and may reconcile concurrently.
+    fd, tmp = tempfile.mkstemp(dir=d, prefix="_index.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(index))
+        os.replace(tmp, d / INDEX_FILE)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def _load_request_index(d: Path) -> dict:
+    """Return {request_id: request}, re-reading any request file whose (mtime_ns, size) differs from the index.
+
+    Dropbox keeps the editing client's mtime, so a synced edit can be older than the index itself;
+    only an exact signature match is trusted.
+    """
+    index = _read_index(d)
+    changed = index is None
+    files, reqs = (index["files"], index["requests"]) if index is not None else ({}, {})
+    seen = set()
+    for p in d.glob("*.json"):
+        if p.name.startswith("_"):
+            continue
+        seen.add(p.stem)
         try:
-            data = json.loads(p.read_text(encoding="utf-8"))
-            rows.append({
-                "RequestID": data.get("request_id", p.stem),
-                "Name": data.get("name",""),
-                "StartDate": pd.to_datetime(data.get("start_date")).date() if data.get("start_date") else None,
-                "EndDate": pd.to_datetime(data.get("end_date")).date() if data.get("end_date") else None,
-                "LeaveType": data.get("leave_type",""),
-                "Approved": bool(data.get("approved", True)),
-                "Notes": data.get("notes",""),
-                "CreatedAt": data.get("created_at",""),
-                "UpdatedAt": data.get("updated_at",""),
-                "_path": str(p),
-            })
+            sig = _file_sig(p)
+            if p.stem in reqs and files.get(p.stem) == sig:
+                continue
+            reqs[p.stem] = orjson.loads(p.read_bytes())
+            files[p.stem] = sig
+            changed = True
+        except Exception:
+            continue
+    for req_id in set(reqs) - seen:
+        reqs.pop(req_id)
+        files.pop(req_id, None)
+        changed = True
+    if changed:
+        _write_index(d, {"files": files, "requests": reqs})
+    return reqs
+
+def _update_index(req_id: str, req: dict | None) -> None:
+    index = _read_index(requests_dir)
+    if index is None:
+        _load_request_index(requests_dir)
+        return
+    if req is None:
+        index["requests"].pop(req_id, None)
+        index["files"].pop(req_id, None)
+    else:
+        index["requests"][req_id] = req
+        index["files"][req_id] = _file_sig(request_file_path(req_id))
+    _write_index(requests_dir, index)
+
+def _requests_signature() -> tuple[int, int]:
+    # Reconcile the index with the request files (a stat each; only changed files are re-read and
+    # the index rewritten), so the index's own mtime/size then identify the current requests.
+    _load_request_index(requests_dir)
+    st_ = (requests_dir / INDEX_FILE).stat()
+    return st_.st_mtime_ns, st_.st_size
+
+def _text(v) -> str:
+    return "" if v is None else str(v)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_requests(dir_str: str, index_mtime_ns: int, index_size: int) -> pd.DataFrame:
+    # The index signature is part of the cache key so the cache invalidates when requests change.
+    d = Path(dir_str)
+    # Build columns directly (not a list of row dicts) so each gets a compact, explicit dtype.
+    cols = req_ids, names, starts, ends, types, approved, notes, created, updated, paths = tuple([] for _ in range(10))
+    for req_id, data in sorted(_load_request_index(d).items()):
+        # Everything that reads the record sits inside the try, so one malformed file is skipped
+        # rather than fatal; text fields are coerced to str for the string/categorical columns.
+        try:
+            rec = (
+                _text(data.get("request_id", req_id)),
+                _text(data.get("name")),
+                parse_date(data.get("start_date")),
+                parse_date(data.get("end_date")),
+                _text(data.get("leave_type")),
+                bool(data.get("approved", True)),
+                _text(data.get("notes")),
+                _text(data.get("created_at")),
+                _text(data.get("updated_at")),
+                str(d / f"{req_id}.json"),
+            )
         except Exception:
             continue
-    df = pd.DataFrame(rows)
+        for col, v in zip(cols, rec):
+            col.append(v)
+    df = pd.DataFrame({
+        "RequestID": pd.array(req_ids, dtype="string"),
+        "Name": pd.array(names, dtype="string"),
+        "StartDate": pd.Series(starts, dtype=object),
+        "EndDate": pd.Series(ends, dtype=object),
+        "LeaveType": pd.Categorical(types, categories=[*ALLOWED_TYPES, *sorted(set(types) - set(ALLOWED_TYPES))]),
+        "Approved": np.array(approved, dtype=bool),
+        "Notes": pd.array(notes, dtype="string"),
+        "CreatedAt": pd.array(created, dtype="string"),
+        "UpdatedAt": pd.array(updated, dtype="string"),
+        "_path": pd.array(paths, dtype="string"),
+    })
     if not df.empty:
         df = df.sort_values(["StartDate","Name"], na_position="last").reset_index(drop=True)
+        # Lowercased columns are built once here so filtering never re-lowercases per rerun.
+        df["_name_lc"] = df["Name"].str.lower().astype("category")
+        df["_type_lc"] = df["LeaveType"].str.lower().astype("category")
+        df["_notes_lc"] = df["Notes"].str.lower()
+        df["Name"] = df["Name"].astype("category")
     return df
 
+def load_requests() -> pd.DataFrame:
+    # Reconciles against the request files on every call, so compile never writes a stale snapshot.
+    return _load_requests(str(requests_dir), *_requests_signature())
+
+def _category_mask(col: pd.Series, value: str) -> np.ndarray:
+    # Compare the categorical's integer codes rather than the strings themselves.
+    code = col.cat.categories.get_indexer([value])[0]
+    if code < 0:
+        return np.zeros(len(col), dtype=bool)
+    return col.cat.codes.to_numpy() == code
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _filter_positions(df_key: tuple, _df: pd.DataFrame, name: str, type_: str, approved: str, search: str) -> np.ndarray:
+    # _df is not hashed by Streamlit; df_key identifies which cached frame it is.
+    mask = np.ones(len(_df), dtype=bool)
+    if name != "(All)":
+        mask &= _category_mask(_df["Name"], name)
+    if type_ != "(All)":
+        mask &= _category_mask(_df["_type_lc"], type_.lower())
+    if approved == "Approved only":
+        mask &= _df["Approved"].to_numpy(dtype=bool)
+    elif approved == "Not approved":
+        mask &= ~_df["Approved"].to_numpy(dtype=bool)
+    if search:
+        mask &= (
+            _df["_name_lc"].str.contains(search, regex=False, na=False)
+            | _df["_notes_lc"].str.contains(search, regex=False, na=False)
+        ).to_numpy(dtype=bool)
+    return np.flatnonzero(mask)
+
 def validate_dates(s: date, e: date) -> str | None:
     if e < s:
         return "Date to cannot be earlier than Date from."
     return None
 
 def upsert_request(req: dict) -> None:
-    request_file_path(req["request_id"]).write_text(json.dumps(req, indent=2), encoding="utf-8")
+    request_file_path(req["request_id"]).write_bytes(orjson.dumps(req, option=orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC))
+    _update_index(req["request_id"], req)
 
 def delete_request(req_id: str) -> None:
     p = request_file_path(req_id)
     if p.exists():
         p.unlink()
+    _update_index(req_id, None)
+
+def _clone_file(src: Path, dst: Path) -> None:
+    # Prefer a copy-on-write clone (APFS clonefile / Linux FICLONE): no data is copied at all.
+    # Otherwise shutil.copyfile, which stays in the kernel via sendfile/fcopyfile.
+    if sys.platform == "darwin":
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+            return
+    elif fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
 
 def workbook_backup(path: Path) -> Path | None:
     try:
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         bkp = path.with_name(f"{path.stem}_backup_{ts}{path.suffix}")
-        bkp.write_bytes(path.read_bytes())
+        _clone_file(path, bkp)
         return bkp
     except Exception:
         return None
 
-def read_consultants_from_workbook(path: Path) -> list[str]:
-    wb = load_workbook(path, data_only=True)
-    if "Consultants" not in wb.sheetnames:
-        return []
-    ws = wb["Consultants"]
-    out = []
-    for r in range(2, 2000):
-        nm = ws[f"A{r}"].value
-        active = ws[f"F{r}"].value
+def save_workbook_atomic(wb, path: Path) -> None:
+    # Write next to the target and swap in, so a failed save never leaves a truncated workbook.
+    # The temp name is unique so concurrent compiles never share (or steal) each other's file.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.stem}.", suffix=f".tmp{path.suffix}")
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def next_empty_row(lws, start_row=2) -> int:
+    # Start from the sheet's used range and only step back over trailing blanks.
+    r = lws.max_row
+    floor = max(start_row - 1, r - MAX_BLANK_RUN)
+    while r > floor and lws.cell(row=r, column=1).value in (None, ""):
+        r -= 1
+    if r > floor or r == start_row - 1:
+        return r + 1
+
+    # max_row is inflated (e.g. formatting applied down to row 1048576): scan
+    # forward instead and give up after MAX_BLANK_RUN consecutive blank rows.
+    last = start_row - 1
+    for r, (v,) in enumerate(lws.iter_rows(min_row=start_row, max_col=1, values_only=True), start=start_row):
+        if v not in (None, ""):
+            last = r
+        elif r - last > MAX_BLANK_RUN:
+            break
+    return last + 1
+
+def _read_sheets(path, *names: str) -> dict[str, list] | None:
+    # python-calamine (Rust) parses each sheet straight into lists of row values,
+    # much faster than openpyxl's XML reader. Empty cells come back as "".
+    wb = CalamineWorkbook.from_path(str(path))
+    if not set(names) <= set(wb.sheet_names):
+        return None
+    return {n: wb.get_sheet_by_name(n).to_python(skip_empty_area=False) for n in names}
+
+def _data_rows(rows: list, ncols: int, min_row: int = 2):
+    # Rows start at A1 but only span the sheet's used width; pad/trim each to ncols cells.
+    pad = [""] * max(0, ncols - len(rows[0])) if rows else []
+    for row in rows[min_row - 1:]:
+        yield row[:ncols] + pad
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def read_consultants_from_workbook(path_str: str, mtime: float) -> tuple[str, ...]:
+    # mtime is part of the cache key so the cache invalidates when the workbook changes.
+    sheets = _read_sheets(path_str, "Consultants")
+    if sheets is None:
+        return ()
+    out = set()
+    for nm, _, _, _, _, active in _data_rows(sheets["Consultants"], 6):
         if nm and bool(active):
-            out.append(str(nm))
-    return sorted(set(out))
+            out.add(str(nm))
+    return tuple(sorted(out))
 
 # Load requests and consultant list
-df = load_requests()
+requests_key = (str(requests_dir), *_requests_signature())
+df = _load_requests(*requests_key)
 
-consultant_names = []
+consultant_names = ()
 if workbook_path_str and workbook_path and workbook_path.exists():
     try:
-        consultant_names = read_consultants_from_workbook(workbook_path)
+        consultant_names = read_consultants_from_workbook(str(workbook_path), workbook_path.stat().st_mtime)
     except Exception:
-        consultant_names = []
+        consultant_names = ()
 
 # -----------------------------
 # Add request
@@ -163,12 +401,12 @@ if submitted:
     elif not name.strip():
         st.error("Consultant name is required.")
     else:
-        req_id = str(uuid.uuid4())
+        req_id = new_request_id()
         req = {
             "request_id": req_id,
             "name": name.strip(),
-            "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat(),
+            "start_date": start_date,
+            "end_date": end_date,
             "leave_type": normalize_leave_type(leave_type),
             "approved": bool(approved),
             "notes": notes.strip(),
@@ -176,7 +414,7 @@ if submitted:
             "updated_at": now_iso(),
         }
         upsert_request(req)
-        st.success(f"Created request {req_id[:8]} for {name}: {start_date} → {end_date} ({leave_type})")
+        st.success(f"Created request {req_id[-8:]} for {name}: {start_date} → {end_date} ({leave_type})")
         st.rerun()
 
 # -----------------------------
@@ -186,7 +424,7 @@ st.subheader("3) View / filter requests")
 
 fc1, fc2, fc3, fc4 = st.columns([2, 1, 1, 2])
 with fc1:
-    filt_name = st.selectbox("Consultant filter", options=["(All)"] + (sorted(df["Name"].unique()) if not df.empty else []))
+    filt_name = st.selectbox("Consultant filter", options=["(All)", *(df["Name"].cat.categories if not df.empty else [])])
 with fc2:
     filt_type = st.selectbox("Type filter", options=["(All)"] + ALLOWED_TYPES)
 with fc3:
@@ -194,21 +432,11 @@ with fc3:
 with fc4:
     search = st.text_input("Search (name/notes contains)", value="")
 
-view = df.copy()
-if not view.empty:
-    if filt_name != "(All)":
-        view = view[view["Name"] == filt_name]
-    if filt_type != "(All)":
-        view = view[view["LeaveType"].str.lower() == filt_type.lower()]
-    if filt_approved == "Approved only":
-        view = view[view["Approved"] == True]
-    elif filt_approved == "Not approved":
-        view = view[view["Approved"] == False]
-    if search.strip():
-        s = search.strip().lower()
-        view = view[view["Name"].str.lower().str.contains(s) | view["Notes"].str.lower().str.contains(s)]
-
-st.dataframe(view.drop(columns=["_path"]) if not view.empty else view, use_container_width=True, hide_index=True)
+view = df
+if not df.empty:
+    view = df.iloc[_filter_positions(requests_key, df, filt_name, filt_type, filt_approved, search.strip().lower())]
+
+st.dataframe(view.drop(columns=[c for c in view.columns if c.startswith("_")]), use_container_width=True, hide_index=True)
 
 # -----------------------------
 # Edit/delete
@@ -220,7 +448,7 @@ else:
     req_ids = view["RequestID"].tolist() if not view.empty else df["RequestID"].tolist()
     selected = st.selectbox("Select RequestID", options=req_ids)
     row = df[df["RequestID"] == selected].iloc[0].to_dict()
-    raw = json.loads(Path(row["_path"]).read_text(encoding="utf-8"))
+    raw = orjson.loads(Path(row["_path"]).read_bytes())
 
     with st.form("edit_form"):
         e1, e2, e3 = st.columns([2, 1, 1])
@@ -233,16 +461,17 @@ else:
                 )
             else:
                 nm = st.text_input("Consultant", value=raw.get("name",""))
+            nt = normalize_leave_type(raw.get("leave_type", "Annual"))
             lt = st.selectbox(
                 "Leave type",
                 options=ALLOWED_TYPES,
-                index=ALLOWED_TYPES.index(normalize_leave_type(raw.get("leave_type","Annual"))) if normalize_leave_type(raw.get("leave_type","Annual")) in ALLOWED_TYPES else 0
+                index=ALLOWED_TYPES.index(nt) if nt in ALLOWED_TYPES else 0
             )
             notes2 = st.text_input("Notes", value=raw.get("notes",""))
         with e2:
-            sd = st.date_input("Date from", value=pd.to_datetime(raw.get("start_date")).date() if raw.get("start_date") else date.today(), key="edit_sd")
+            sd = st.date_input("Date from", value=parse_date(raw.get("start_date")) or date.today(), key="edit_sd")
         with e3:
-            ed = st.date_input("Date to", value=pd.to_datetime(raw.get("end_date")).date() if raw.get("end_date") else sd, key="edit_ed")
+            ed = st.date_input("Date to", value=parse_date(raw.get("end_date")) or sd, key="edit_ed")
         appr = st.checkbox("Approved", value=bool(raw.get("approved", True)))
 
         csave, cdel = st.columns([1, 1])
@@ -260,8 +489,8 @@ else:
         else:
             raw["name"] = nm.strip()
             raw["leave_type"] = normalize_leave_type(lt)
-            raw["start_date"] = sd.isoformat()
-            raw["end_date"] = ed.isoformat()
+            raw["start_date"] = sd
+            raw["end_date"] = ed
             raw["approved"] = bool(appr)
             raw["notes"] = notes2.strip()
             raw["updated_at"] = now_iso()
@@ -339,29 +568,30 @@ else:
                     st.stop()
 
                 lws = wb["Leave"]
+                start_row = next_empty_row(lws, start_row=2)
 
                 if replace_leave_sheet:
-                    for r in range(2, 5000):
-                        if lws[f"A{r}"].value in (None, ""):
-                            break
-                        for col in ("A", "B", "C", "D", "E"):
-                            lws[f"{col}{r}"].value = None
+                    # Blank A-E in place so cell formats and helper columns beyond E survive
+                    for cells in lws.iter_rows(min_row=2, max_row=start_row - 1, max_col=5):
+                        for cell in cells:
+                            cell.value = None
+                    start_row = 2
 
                 df2 = load_requests()
                 if df2.empty:
                     st.warning("No requests to compile.")
                     st.stop()
 
-                r = 2
-                for _, rec in df2.iterrows():
-                    lws[f"A{r}"].value = rec["Name"]
-                    lws[f"B{r}"].value = rec["StartDate"]
-                    lws[f"C{r}"].value = rec["EndDate"]
-                    lws[f"D{r}"].value = normalize_leave_type(rec["LeaveType"])
-                    lws[f"E{r}"].value = bool(rec["Approved"])
-                    r += 1
+                # Normalise the whole LeaveType column at once (df2 is the cached frame, so don't assign into it).
+                raw_types = df2["LeaveType"].astype("string").fillna("").str.strip()
+                leave_types = raw_types.str.lower().map(LEAVE_TYPE_MAP).fillna(raw_types)
+                leave_cols = ["Name", "StartDate", "EndDate", "LeaveType", "Approved"]
+                leave_rows = df2[leave_cols].assign(LeaveType=leave_types).itertuples(index=False, name=None)
+                for cells, (nm, sd, ed, lt, appr) in zip(lws.iter_rows(min_row=start_row, max_row=start_row + len(df2) - 1, max_col=5), leave_rows):
+                    for cell, v in zip(cells, (nm, sd, ed, lt, bool(appr))):
+                        cell.value = v
 
-                wb.save(workbook_path)
+                save_workbook_atomic(wb, workbook_path)
                 st.success(f"Compiled {len(df2)} requests into Leave sheet and saved workbook.")
             except Exception as e:
                 st.exception(e)